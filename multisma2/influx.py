@@ -216,11 +216,31 @@ class InfluxDB:
             raise InfluxDBWriteError(f"Unexpected failure in write_history(): {e}")
 
     def write_sma_sensors(self, sensor, timestamp=None):
+        return self.write_sma_sensors_batch([sensor], timestamp=timestamp)
+
+    def write_sma_sensors_batch(self, sensors, timestamp=None):
+        """Write a list of sensors to InfluxDB in a single request."""
         if not self._client:
             return False
 
         ts = timestamp if timestamp is not None else int(time.time())
         lps = []
+        for sensor in sensors:
+            lps.extend(self.sensor_lps(sensor, ts))
+        if not lps:
+            return True
+
+        try:
+            self._write_api.write(bucket=self._bucket, record=lps, write_precision=WritePrecision.S)
+            return True
+        except ApiException as e:
+            raise InfluxDBWriteError(f"InfluxDB client unable to write to '{self._bucket}' at {self._url}: {e.reason}")
+        except Exception as e:
+            raise InfluxDBWriteError(f"Unexpected failure in write_sma_sensors_batch(): {e}")
+
+    def sensor_lps(self, sensor, timestamp):
+        """Convert a sensor to line protocol, period totals are stamped at the start of the period."""
+        lps = []
         for old_point in sensor:
             point = old_point.copy()
             topic = point.pop('topic', None)
@@ -228,22 +248,23 @@ class InfluxDB:
             if topic:
                 lookup = LP_LOOKUP.get(topic, None)
                 if not lookup:
-                    _LOGGER.error(f"write_sma_sensors(): unknown topic '{topic}'")
+                    _LOGGER.error(f"write_sma_sensors_batch(): unknown topic '{topic}'")
                     continue
 
                 if not lookup.get('output', False):
                     continue
 
+                ts = timestamp
                 if topic == 'production/today':
-                    day = datetime.datetime.fromtimestamp(ts).date()
+                    day = datetime.datetime.fromtimestamp(timestamp).date()
                     dt = datetime.datetime.combine(day, datetime.time(0, 0))
                     ts = int(dt.timestamp())
                 elif topic == 'production/month':
-                    month = datetime.date.fromtimestamp(ts).replace(day=1)
+                    month = datetime.date.fromtimestamp(timestamp).replace(day=1)
                     dt = datetime.datetime.combine(month, datetime.time(0, 0))
                     ts = int(dt.timestamp())
                 elif topic == 'production/year':
-                    year = datetime.date.fromtimestamp(ts).replace(month=1, day=1)
+                    year = datetime.date.fromtimestamp(timestamp).replace(month=1, day=1)
                     dt = datetime.datetime.combine(year, datetime.time(0, 0))
                     ts = int(dt.timestamp())
 
@@ -284,19 +305,13 @@ class InfluxDB:
                                 lps.append(lp)
                             else:
                                 _LOGGER.error(
-                                    f"write_sma_sensors(): unanticipated dictionary type '{type(v1)}' in measurement '{measurement}/{field}'")
+                                    f"write_sma_sensors_batch(): unanticipated dictionary type '{type(v1)}' in measurement '{measurement}/{field}'")
                     else:
                         _LOGGER.error(
-                            f"write_sma_sensors(): unanticipated type '{type(v)}' in measurement '{measurement}/{field}'")
+                            f"write_sma_sensors_batch(): unanticipated type '{type(v)}' in measurement '{measurement}/{field}'")
                         continue
 
-        try:
-            self._write_api.write(bucket=self._bucket, record=lps, write_precision=WritePrecision.S)
-            return True
-        except ApiException as e:
-            raise InfluxDBWriteError(f"InfluxDB client unable to write to '{self._bucket}' at {self._url}: {e.reason}")
-        except Exception as e:
-            raise InfluxDBWriteError(f"Unexpected failure in write_sma_sensors(): {e}")
+        return lps
 
     def delete_bucket(self):
         if not self._client:
@@ -2,6 +2,7 @@
 
 import asyncio
 import datetime
+import time
 import logging
 import json
 from pprint import pprint
@@ -15,9 +16,12 @@ from exceptions import SmaException
 _LOGGER = logging.getLogger('multisma2')
 
 # Inverter keys that contain aggregates
-AGGREGATE_KEYS = [
+AGGREGATE_KEYS = frozenset([
     '6380_40251E00',  # DC Power (current power)
-]
+])
+
+# Subkeys used for multi-phase/multi-string values
+_SUBKEYS = ('a', 'b', 'c')
 
 
 class Inverter:
@@ -33,6 +37,8 @@ class Inverter:
         self._sma = None
         self._metadata = None
         self._tags = None
+        self._keys_by_unit = {}
+        self._key_info = {}
         self._instantaneous = None
         self._history = {}
         self._lock = asyncio.Lock()
@@ -43,28 +49,38 @@ class Inverter:
         try:
             self._sma = sma.SMA(session=self._session, url=self._url, password=self._password, group=self._group)
         except SmaException as e:
-            _LOGGER.debug(f"Inverter error with '{self._url}': '{e.name}'")
+            _LOGGER.debug("Inverter error with '%s': '%s'", self._url, e.name)
             return {'keys': None, 'name': self._url, 'error': e.name}
 
         try:
             await self._sma.new_session()
             _LOGGER.debug(
-                f"Connected to SMA inverter '{self._name}' at {self._url} with session ID '{self._sma.sma_sid}'")
+                "Connected to SMA inverter '%s' at %s with session ID '%s'", self._name, self._url, self._sma.sma_sid)
         except SmaException as e:
-            _LOGGER.debug(f"{self._name}, login failed: {e}")
+            _LOGGER.debug("%s, login failed: %s", self._name, e)
             return {'keys': None, 'name': self._url, 'error': e.name}
 
-        # Grab the metadata dictionary
+        # Grab the metadata and inverter tag dictionaries
         metadata_url = self._url + '/data/ObjectMetadata_Istl.json'
-        async with self._session.get(metadata_url) as resp:
-            assert resp.status == 200
-            self._metadata = json.loads(await resp.text())
-
-        # Grab the inverter tag dictionary
         tag_url = self._url + '/data/l10n/en-US.json'
-        async with self._session.get(tag_url) as resp:
-            assert resp.status == 200
-            self._tags = json.loads(await resp.text())
+        self._metadata, self._tags = await asyncio.gather(
+            self.read_json(metadata_url),
+            self.read_json(tag_url),
+        )
+
+        # Build the reverse index of unit tag to keys and the per-key metadata lookups
+        self._keys_by_unit = {}
+        self._key_info = {}
+        for key, metadata in self._metadata.items():
+            unit_tag = metadata.get('Unit', None)
+            self._keys_by_unit.setdefault(unit_tag, []).append(key)
+            precision = metadata.get('DataFrmt', None)
+            self._key_info[key] = {
+                'unit': self.lookup_tag(unit_tag) if unit_tag else None,
+                'precision': precision if precision is not None and precision <= 3 else None,
+                'scale': metadata.get('Scale', None),
+                'type': metadata.get('Typ', None),
+            }
 
         # Read the initial set of history state data
         success = await self.read_inverter_production()
@@ -77,6 +93,12 @@ class Inverter:
         # Return a list of cached keys
         return {'keys': self._instantaneous.keys(), 'name': self._url, 'error': None}
 
+    async def read_json(self, url):
+        """Read and decode a JSON file from the inverter."""
+        async with self._session.get(url) as resp:
+            assert resp.status == 200
+            return json.loads(await resp.text())
+
     async def stop(self):
         """Log out of the interter."""
         if self._sma:
@@ -89,27 +111,24 @@ class Inverter:
         for key, value in raw_results.items():
             if not value:
                 continue
-            aggregate = AGGREGATE_KEYS.count(key)
+            aggregate = key in AGGREGATE_KEYS
             sma_type = self.get_type(key)
             scale = self.get_scale(key)
-            states = value.pop('1', None)
+            states = value.get('1', None) or ()
             if sma_type == 0:
                 sensors = {}
-                total = 0
-                subkeys = ['a', 'b', 'c']
                 val = 0
-                for index, state in enumerate(states):
+                for subkey, state in zip(_SUBKEYS, states):
                     val = state.get('val', None)
                     if val is None:
                         val = 0
                     if scale != 1:
                         val *= scale
-                    total += val
-                    sensors[subkeys[index]] = val
+                    sensors[subkey] = val
 
                 if len(states) > 1:
                     if aggregate:
-                        sensors[self.name()] = total
+                        sensors[self._name] = sum(sensors.values())
                     val = sensors
                 cleaned[key] = {'val': val}
             elif sma_type == 1:
@@ -118,7 +137,7 @@ class Inverter:
                     cleaned[key] = {'val': tag_list[0].get('tag')}
                     break
             else:
-                _LOGGER.warning(f"unexpected sma type: {sma_type}")
+                _LOGGER.warning("unexpected sma type: %s", sma_type)
 
         cleaned['name'] = self._name
         return cleaned
@@ -132,7 +151,7 @@ class Inverter:
                 self._instantaneous = await self._sma.read_instantaneous()
             return {'name': self._name, 'sensors': self._instantaneous, 'error': 'None'}
         except SmaException as e:
-            _LOGGER.debug(f"{self._name} read_instantaneous() error: {e.name}")
+            _LOGGER.debug("%s read_instantaneous() error: %s", self._name, e.name)
             return {'name': self._name, 'sensors': None, 'error': e.name}
 
     async def read_keys(self, keys):
@@ -147,7 +166,7 @@ class Inverter:
         try:
             raw_result = await self._sma.read_values([key])
         except SmaException as e:
-            _LOGGER.debug(f"{self._name}: read_key({key}): {e.name}")
+            _LOGGER.debug("%s: read_key(%s): %s", self._name, key, e.name)
             return False
         if raw_result:
             return self.clean({key: raw_result.get(key)})
@@ -157,27 +176,27 @@ class Inverter:
         try:
             history = await self._sma.read_history(start, stop)
         except SmaException as e:
-            _LOGGER.debug(f"{self._name}: read_history({start}, {stop}): {e.name}")
+            _LOGGER.debug("%s: read_history(%s, %s): %s", self._name, start, stop, e.name)
             return None
         if not history:
-            _LOGGER.debug(f"{self._name}: read_history({start}, {stop}) returned 'None' (check your local time)")
+            _LOGGER.debug("%s: read_history(%s, %s) returned 'None' (check your local time)", self._name, start, stop)
             return None
         history.insert(0, {'inverter': self._name})
         return history
 
     async def read_inverter_production(self):
         """Read the baseline inverter production for select periods."""
-        before_delta = datetime.timedelta(hours=1)
-        after_delta = datetime.timedelta(hours=1)
-        stop = datetime.datetime.now() + after_delta
-        today = datetime.datetime.combine(datetime.date.today(), datetime.time(0, 0)) - before_delta
-        month = datetime.datetime.combine(datetime.date.today().replace(day=1), datetime.time(0, 0)) - before_delta
-        year = datetime.datetime.combine(datetime.date.today().replace(
-            month=1, day=1), datetime.time(0, 0)) - before_delta
+        before_delta = 3600
+        after_delta = 3600
+        stop = int(time.time()) + after_delta
+        midnight = datetime.datetime.combine(datetime.date.today(), datetime.time(0, 0))
+        today = int(midnight.timestamp()) - before_delta
+        month = int(midnight.replace(day=1).timestamp()) - before_delta
+        year = int(midnight.replace(month=1, day=1).timestamp()) - before_delta
         results = await asyncio.gather(
-            self.read_history(int(today.timestamp()), int(stop.timestamp())),
-            self.read_history(int(month.timestamp()), int(stop.timestamp())),
-            self.read_history(int(year.timestamp()), int(stop.timestamp())),
+            self.read_history(today, stop),
+            self.read_history(month, stop),
+            self.read_history(year, stop),
         )
         if None in results:
             return False
@@ -189,7 +208,7 @@ class Inverter:
         #  'month': {'t': 1609477200, 'v': 3055878},
         #  'year': {'t': 1609477200, 'v': 3055878},
         #  'lifetime': {'t': 0, 'v': 0}}
-        _LOGGER.debug(f"{self._name}/read_inverter_production({today}/{stop}): {self._history}")
+        _LOGGER.debug("%s/read_inverter_production(%s/%s): %s", self._name, today, stop, self._history)
         return True
 
     def display_metadata(self, key):
@@ -200,8 +219,9 @@ class Inverter:
     async def get_state(self, key):
         """Return the state for a given key."""
         assert self._instantaneous is not None
-        async with self._lock:
-            state = self._instantaneous.get(key, None).copy()
+        # The cached results are replaced wholesale by read_instantaneous() and clean()
+        # does not modify them, so no lock is needed to read a consistent state
+        state = self._instantaneous.get(key, None)
         cleaned = self.clean({key: state})
         return cleaned
 
@@ -210,43 +230,24 @@ class Inverter:
         return self._name
 
     async def keys_for_unit(self, unit_tag):
-        keys = []
-        for key, metadata in self._metadata.items():
-            unit = metadata.get('Unit', None)
-            if unit == unit_tag:
-                keys.append(key)
-        return keys
+        """Return the keys that use a given unit tag."""
+        return list(self._keys_by_unit.get(unit_tag, []))
 
     def get_unit(self, key):
         """Return the unit used for a given key."""
-        metadata = self._metadata.get(key, '???')
-        if metadata:
-            unit_tag = metadata.get('Unit', None)
-            if unit_tag:
-                return self.lookup_tag(unit_tag)
-        return None
+        return self._key_info.get(key, {}).get('unit', None)
 
     def get_precision(self, key):
         """Return the precision for a given key."""
-        precision = None
-        metadata = self._metadata.get(key, None)
-        if metadata:
-            precision = metadata.get('DataFrmt', None)
-            if precision > 3:
-                precision = None
-        return precision
+        return self._key_info.get(key, {}).get('precision', None)
 
     def get_scale(self, key):
         """Return the scale value for a given key."""
-        metadata = self._metadata.get(key, None)
-        if metadata:
-            return metadata.get('Scale', None)
-        return None
+        return self._key_info.get(key, {}).get('scale', None)
 
     def get_type(self, key):
         """Return the type of a given key."""
-        metadata = self._metadata.get(key, '???')
-        return metadata.get('Typ', None)
+        return self._key_info.get(key, {}).get('type', None)
 
     def lookup_tag(self, key):
         """Return tag dictionary value for the specified key."""
@@ -255,16 +256,16 @@ class Inverter:
     async def start_production(self, period):
         """Return production value for the start of the specified period."""
         history = self._history.get(period)
-        _LOGGER.debug(f"{self._name}/start_production({period}): {history['v']}")
+        _LOGGER.debug("%s/start_production(%s): %s", self._name, period, history['v'])
         return {self.name(): history['v']}
 
     async def read_inverter_history(self, start, stop):
         """Read the baseline inverter production."""
         try:
             history = await self._sma.read_history(start, stop)
-            _LOGGER.debug(f"{self._name}/read_inverter_history({start}, {stop}): {history}")
+            _LOGGER.debug("%s/read_inverter_history(%s, %s): %s", self._name, start, stop, history)
         except SmaException as e:
-            _LOGGER.debug(f"{self._name}: read_inverter_history({start}, {stop}): {e.name}")
+            _LOGGER.debug("%s: read_inverter_history(%s, %s): %s", self._name, start, stop, e.name)
             return None
         history.insert(0, {'inverter': self._name})
         return history
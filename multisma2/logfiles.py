@@ -2,9 +2,11 @@
 
 import os
 import sys
+import queue
 from datetime import datetime
+from pathlib import Path
 import logging
-from logging.handlers import TimedRotatingFileHandler
+from logging.handlers import TimedRotatingFileHandler, QueueHandler, QueueListener
 
 
 _LOGGER = logging.getLogger('multisma2')
@@ -13,6 +15,8 @@ _DEFAULT_LOG_FILE = 'log/multisma2'
 _DEFAULT_LOG_FORMAT = '[%(asctime)s] [%(module)s] [%(levelname)s] %(message)s'
 _DEFAULT_LOG_LEVEL = 'INFO'
 
+_LOCAL_VARS = {}
+
 
 def start():
     """Create the application log."""
@@ -25,13 +29,11 @@ def start():
     log_level = _DEFAULT_LOG_LEVEL if not debug_mode else 'DEBUG'
 
     now = datetime.now()
-    filename = os.path.expanduser(log_file + "_" + now.strftime("%Y-%m-%d") + ".log")
+    path = Path(os.path.expanduser(log_file + "_" + now.strftime("%Y-%m-%d") + ".log")).absolute()
 
     # Create the directory if needed
-    filename_parts = os.path.split(filename)
-    if filename_parts[0] and not os.path.isdir(filename_parts[0]):
-        os.mkdir(filename_parts[0])
-    filename = os.path.abspath(filename)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    filename = str(path)
 
     # Change log files at midnight
     handler = TimedRotatingFileHandler(filename, when='midnight', interval=1, backupCount=10)
@@ -39,14 +41,27 @@ def start():
     handler.setLevel(log_level)
     formatter = logging.Formatter(log_format)
     handler.setFormatter(formatter)
-    _LOGGER.addHandler(handler)
 
     # Add some console output for anyone watching
     console_handler = logging.StreamHandler(sys.stdout)
     console_handler.setLevel(log_level)
     console_handler.setFormatter(logging.Formatter(log_format))
-    _LOGGER.addHandler(console_handler)
+
+    # File and console I/O is done by a listener thread, logging calls just queue the record
+    log_queue = queue.SimpleQueue()
+    listener = QueueListener(log_queue, handler, console_handler, respect_handler_level=True)
+    listener.start()
+    _LOCAL_VARS['listener'] = listener
+
+    _LOGGER.addHandler(QueueHandler(log_queue))
     _LOGGER.setLevel(log_level)
 
     # First entry
     _LOGGER.info("Created application log %s", filename)
+
+
+def stop():
+    """Flush any queued log records and stop the listener thread."""
+    listener = _LOCAL_VARS.pop('listener', None)
+    if listener:
+        listener.stop()
@@ -5,32 +5,55 @@ import atexit
 import os
 import sys
 import socket
-import random
-import string
-import time
+import secrets
+import threading
 import logging
 
 import json
 import paho.mqtt.client as mqtt
 
+try:
+    import orjson
+    _json_dumps = orjson.dumps
+except ImportError:
+    def _json_dumps(obj):
+        return json.dumps(obj).encode()
+
 from exceptions import FailedInitialization
 
 
 _LOGGER = logging.getLogger('multisma2')
 _LOCAL_VARS = {}
+_TOPIC_CACHE = {}
+
+# Sensor dictionary keys that are not part of the published payload
+_RESERVED_KEYS = ('topic', 'precision')
+
+# Required 'mqtt' YAML options and their types
+_REQUIRED_OPTIONS = (
+    ('enable', bool),
+    ('client', str),
+    ('ip', str),
+    ('port', int),
+    ('username', str),
+    ('password', str),
+)
+_MISSING = object()
+
+
+_ERROR_MESSAGES = {
+    0: "MQTT_ERR_SUCCESS",
+    1: "MQTT_ERR_NOMEM",
+    2: "MQTT_ERR_PROTOCOL",
+    3: "MQTT_ERR_INVAL",
+    4: "MQTT_ERR_NO_CONN",
+    5: "MQTT_ERR_CONN_REFUSED",
+}
 
 
 def error_msg(code):
     """Convert a result code to string."""
-    error_messages = {
-        "0": "MQTT_ERR_SUCCESS",
-        "1": "MQTT_ERR_NOMEM",
-        "2": "MQTT_ERR_PROTOCOL",
-        "3": "MQTT_ERR_INVAL",
-        "4": "MQTT_ERR_NO_CONN",
-        "5": "MQTT_ERR_CONN_REFUSED",
-    }
-    return error_messages.get(str(code), "unknown error code: " + str(code))
+    return _ERROR_MESSAGES.get(code, f"unknown error code: {code}")
 
 
 def on_disconnect(client, userdata, result_code):
@@ -42,8 +65,7 @@ def on_disconnect(client, userdata, result_code):
         _LOGGER.info("MQTT client successfully disconnected")
     else:
         client.disconnect_failed = True
-        _LOGGER.info(
-            f"MQTT client unexpectedly disconnected: {error_msg(result_code)}, trying reconnect()")
+        _LOGGER.info("MQTT client unexpectedly disconnected: %s, trying reconnect()", error_msg(result_code))
 
 
 def on_connect(client, userdata, flags, result_code):
@@ -52,37 +74,32 @@ def on_connect(client, userdata, flags, result_code):
     if result_code == mqtt.MQTT_ERR_SUCCESS:
         client.connected = True
         type, ip, port, topic = userdata['Type'], userdata['IP'], userdata['Port'], _LOCAL_VARS['client']
-        _LOGGER.info(f"{type} client successfully connected to {ip}:{port} using topic '{topic}/#'")
+        _LOGGER.info("%s client successfully connected to %s:%s using topic '%s/#'", type, ip, port, topic)
     else:
         client.connection_failed = True
-        _LOGGER.info(f"MQTT client connection failed: {error_msg(result_code)}")
+        _LOGGER.info("MQTT client connection failed: %s", error_msg(result_code))
+    userdata['Event'].set()
 
 
 def mqtt_exit():
     """Close the MQTT connection when exiting using atexit()."""
-    # Disconnect the MQTT client from the broker
-    _LOCAL_VARS['mqtt_client'].loop_stop()
-    _LOGGER.debug("MQTT client disconnect being called")
-    _LOCAL_VARS['mqtt_client'].disconnect()
+    stop()
 
 
 def check_config(mqtt):
     """Check that the needed YAML options exist."""
     errors = False
-    required = {'enable': bool, 'client': str, 'ip': str, 'port': int, 'username': str, 'password': str}
-    options = dict(mqtt)
-    for key in required:
-        if key not in options.keys():
+    for key, key_type in _REQUIRED_OPTIONS:
+        v = mqtt.get(key, _MISSING)
+        if v is _MISSING:
             _LOGGER.error(f"Missing required 'mqtt' option in YAML file: '{key}'")
             errors = True
-        else:
-            v = options.get(key, None)
-            if not isinstance(v, required.get(key)):
-                _LOGGER.error(f"Expected type '{required.get(key).__name__}' for option 'mqtt.{key}'")
-                errors = True
+        elif not isinstance(v, key_type):
+            _LOGGER.error(f"Expected type '{key_type.__name__}' for option 'mqtt.{key}'")
+            errors = True
     if errors:
         raise FailedInitialization(Exception("Errors detected in 'mqtt' YAML options"))
-    return options
+    return mqtt
 
 
 #
@@ -101,40 +118,36 @@ def start(config):
         return True
 
     result = False
+    client_topic, ip, port = config.client, config.ip, config.port
+    username, password = config.username, config.password
 
     # Create a unique client name
-    _LOCAL_VARS['client'] = config.client
-    _LOCAL_VARS['clientname'] = (
-        config.client
-        + "_"
-        + "".join(random.choices(string.ascii_uppercase + string.digits, k=4))
-    )
+    _LOCAL_VARS['client'] = client_topic
+    _TOPIC_CACHE.clear()
+    _LOCAL_VARS['clientname'] = f"{client_topic}_{secrets.token_hex(2).upper()}"
 
     # Check if MQTT is configured properly, create the connection
-    connection_type = ('authenticated', 'anonymous')[len(config.username) == 0]
+    connection_type = ('authenticated', 'anonymous')[len(username) == 0]
+    connect_event = threading.Event()
     client = mqtt.Client(
         _LOCAL_VARS['clientname'],
-        userdata={'IP': config.ip, 'Port': config.port, 'Type': connection_type},
+        userdata={'IP': ip, 'Port': port, 'Type': connection_type, 'Event': connect_event},
     )
 
     # Setup and try to connect to the broker
-    _LOGGER.debug(f"Attempting {connection_type} MQTT client connection to {config.ip}:{config.port}")
+    _LOGGER.debug("Attempting %s MQTT client connection to %s:%s", connection_type, ip, port)
 
     client.on_connect = on_connect
-    client.username_pw_set(username=config.username, password=config.password)
+    client.username_pw_set(username=username, password=password)
     try:
         # Initialize flags for connection status
         client.connected = client.connection_failed = False
         time_limit = 4.0
-        sleep_time = 0.1
         client.loop_start()
-        client.connect(config.ip, port=config.port)
+        client.connect(ip, port=port)
 
-        # Wait for the connection to occur or timeout
-        while not client.connected and not client.connection_failed and time_limit > 0:
-            time.sleep(sleep_time)
-            time_limit -= sleep_time
-        if not client.connected and not client.connection_failed:
+        # Wait for the connection callback or timeout
+        if not connect_event.wait(timeout=time_limit):
             _LOGGER.error("MQTT timeout error, no response")
 
     except socket.gaierror:
@@ -157,47 +170,77 @@ def start(config):
         client.on_disconnect = on_disconnect
         client.reconnect_delay_set(min_delay=1, max_delay=120)
         _LOCAL_VARS['mqtt_client'] = client
-        atexit.register(mqtt_exit)
+        if not _LOCAL_VARS.get('atexit', False):
+            # Restarts reuse the hook, it closes whichever client is connected at exit
+            atexit.register(mqtt_exit)
+            _LOCAL_VARS['atexit'] = True
         return True
 
     # Some sort of error occurred
     return result
 
 
+def stop():
+    """Stop the MQTT client network loop and disconnect from the broker."""
+    client = _LOCAL_VARS.pop('mqtt_client', None)
+    if client is None:
+        return
+    client.loop_stop()
+    _LOGGER.debug("MQTT client disconnect being called")
+    client.disconnect()
+
+
 def publish(sensors):
     """Publish a dictionary of sensor keys amd values using MQTT."""
     # Check if MQTT is not connected to a broker or the sensor list is empty
-    if 'mqtt_client' not in _LOCAL_VARS or not sensors:
+    client = _LOCAL_VARS.get('mqtt_client', None)
+    if client is None or not sensors:
         return
+    client_publish = client.publish
 
-    # Separate out the sensor dictionaries
+    # Serialize all the sensor dictionaries before handing them to the client
+    messages = []
     for original_sensor in sensors:
-        sensor = original_sensor.copy()
-        if 'topic' not in sensor:
-            _LOGGER.warning(f"'topic' not in sensor dictionary: {str(sensor)}")
+        if 'topic' not in original_sensor:
+            _LOGGER.warning("'topic' not in sensor dictionary: %s", original_sensor)
             continue
 
         # Extract the topic and precision from the dictionary
-        topic = sensor.pop('topic')
-        precision = sensor.pop('precision', None)
-
-        # Limit floats to the requested precision
-        for key, value in sensor.items():
-            if isinstance(value, dict):
-                for dict_key, dict_value in value.items():
-                    value[dict_key] = round(dict_value, precision) if precision else dict_value
-            if isinstance(value, float):
-                sensor[key] = round(value, precision) if precision else value
-
-        # Encode each sensor in JSON and publish
-        sensor_json = json.dumps(sensor)
-        message_info = _LOCAL_VARS['mqtt_client'].publish(
-            _LOCAL_VARS['client'] + "/" + topic, sensor_json
-        )
+        topic = original_sensor.get('topic')
+        precision = original_sensor.get('precision', None)
+
+        # Build the outgoing sensor, limiting floats to the requested precision
+        if not precision:
+            sensor = {key: value for key, value in original_sensor.items() if key not in _RESERVED_KEYS}
+        else:
+            sensor = {}
+            for key, value in original_sensor.items():
+                if key in _RESERVED_KEYS:
+                    continue
+                if isinstance(value, dict):
+                    value = {dict_key: round(dict_value, precision) for dict_key, dict_value in value.items()}
+                elif isinstance(value, float):
+                    value = round(value, precision)
+                sensor[key] = value
+
+        # Full topic names are cached since there is a small fixed set
+        full_topic = _TOPIC_CACHE.get(topic, None)
+        if full_topic is None:
+            full_topic = _TOPIC_CACHE[topic] = _LOCAL_VARS['client'] + "/" + topic
+
+        # Encode each sensor in JSON
+        messages.append((topic, full_topic, _json_dumps(sensor)))
+
+    # Queue the messages back-to-back so the network thread can coalesce the writes
+    for topic, full_topic, sensor_json in messages:
+        message_info = client_publish(full_topic, sensor_json)
         if message_info.rc != mqtt.MQTT_ERR_SUCCESS:
-            _LOGGER.warning(
-                f"MQTT message topic '{topic}'' failed to publish: {error_msg(message_info.rc)}",
-            )
+            _LOGGER.warning("MQTT message topic '%s' failed to publish: %s", topic, error_msg(message_info.rc))
+
+
+def publish_many(sensor_lists):
+    """Publish several lists of sensor dictionaries with a single publish() pass."""
+    publish([sensor for sensors in sensor_lists if sensors for sensor in sensors])
 
 
 if __name__ == '__main__':
@@ -1,18 +1,22 @@
 """Code to interface with the SMA inverters and return the results."""
-# Robust initialization and shutdown code courtesy of
+# Initialization and shutdown structure adapted from
 # https://github.com/wbenny/python-graceful-shutdown.git
 
 import logging
 import sys
 import os
-import time
 import signal
+import socket
 from readconfig import read_config
 
 import asyncio
 import aiohttp
 
-from delayedints import DelayedKeyboardInterrupt
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
+
 from pvsite import PVSite
 import version
 import logfiles
@@ -20,6 +24,7 @@ from exceptions import TerminateSignal, NormalCompletion, AbnormalCompletion, Fa
 
 
 _LOGGER = logging.getLogger('multisma2')
+_VERSION = version.get_version()
 
 
 class Multisma2():
@@ -27,94 +32,135 @@ class Multisma2():
     def __init__(self, config):
         """Initialize the Multisma2 instance."""
         self._config = config
-        self._loop = asyncio.new_event_loop()
         self._session = None
         self._pvsite = None
-        signal.signal(signal.SIGTERM, self.catch)
-        signal.siginterrupt(signal.SIGTERM, False)
+        self._shutdown = None
 
-    def catch(self, signum, frame):
-        """Handler for SIGTERM signals."""
-        _LOGGER.critical("Received SIGTERM signal, forcing shutdown")
-        raise TerminateSignal
+    def catch(self, signum):
+        """Handler for SIGINT and SIGTERM signals."""
+        _LOGGER.critical(f"Received {signal.Signals(signum).name} signal, forcing shutdown")
+        if self._shutdown:
+            self._shutdown.set()
 
     def run(self):
         """Code to handle the start(), run(), and stop() interfaces."""
         # ERROR_DELAY might be non-zero when some errors are detected *for now not implemented)
         ERROR_DELAY = 10
-        delay = 0
-        try:
-            try:
-                with DelayedKeyboardInterrupt():
-                    self._start()
-            except KeyboardInterrupt:
-                _LOGGER.critical("Received KeyboardInterrupt during startup")
-                raise
-
-            self._run()
-            raise NormalCompletion
-
-        except (KeyboardInterrupt, NormalCompletion, TerminateSignal):
-            pass
-        except AbnormalCompletion:
-            _LOGGER.critical("Received AbnormalCompletion exception")
-            delay = ERROR_DELAY
-        except FailedInitialization:
-            _LOGGER.debug("Received FailedInitialization exception")
-            delay = ERROR_DELAY
-        except Exception as e:
-            _LOGGER.error(f"Unexpected exception caught: {e}")
-            delay = ERROR_DELAY
-        finally:
+        while True:
+            delay = 0
+            restart = False
             try:
-                with DelayedKeyboardInterrupt():
-                    self._stop()
-            except KeyboardInterrupt:
-                _LOGGER.critical("Received KeyboardInterrupt during shutdown")
-            finally:
-                if delay > 0:
+                asyncio.run(self._amain())
+                raise NormalCompletion
+
+            except (KeyboardInterrupt, NormalCompletion, TerminateSignal):
+                pass
+            except AbnormalCompletion:
+                _LOGGER.critical("Received AbnormalCompletion exception")
+                delay = ERROR_DELAY
+                restart = True
+            except FailedInitialization:
+                _LOGGER.debug("Received FailedInitialization exception")
+                delay = ERROR_DELAY
+            except Exception as e:
+                _LOGGER.error(f"Unexpected exception caught: {e}")
+                delay = ERROR_DELAY
+
+            if delay > 0:
+                if restart:
+                    _LOGGER.info(f"multisma2 is restarting in {delay} seconds")
+                else:
                     _LOGGER.info(
                         f"multisma2 is delaying restart for {delay} seconds (Docker will restart multisma2, otherwise exits)")
-                    time.sleep(delay)
+                try:
+                    asyncio.run(self._adelay(delay))
+                except (KeyboardInterrupt, TerminateSignal):
+                    break
+            if not restart:
+                break
+
+    def _install_signal_handlers(self):
+        """Route SIGINT and SIGTERM to the shutdown event of the running loop."""
+        loop = asyncio.get_running_loop()
+        self._shutdown = asyncio.Event()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(signum, self.catch, signum)
+            except NotImplementedError:
+                # Windows event loops don't support add_signal_handler()
+                signal.signal(signum, lambda signum, frame: loop.call_soon_threadsafe(self.catch, signum))
+
+    async def _adelay(self, delay):
+        """Wait before restarting, a shutdown signal ends the wait with TerminateSignal."""
+        self._install_signal_handlers()
+        try:
+            await asyncio.wait_for(self._shutdown.wait(), timeout=delay)
+        except asyncio.TimeoutError:
+            return
+        raise TerminateSignal
+
+    async def _amain(self):
+        """Start, run, and stop multisma2 inside a single event loop."""
+        self._install_signal_handlers()
+
+        # Keep the inverter connections alive between sampling intervals and fail stalled sockets quickly
+        # Inverter addresses rarely change, so resolve them once an hour and only over IPv4
+        connector = aiohttp.TCPConnector(
+            ssl=False, limit_per_host=4, keepalive_timeout=75,
+            use_dns_cache=True, ttl_dns_cache=3600, family=socket.AF_INET)
+        # The total limit also ends requests that keep trickling data, like the metadata reads
+        timeout = aiohttp.ClientTimeout(total=60, connect=5, sock_read=10)
+        # Let the inverter webservers send compressed JSON
+        headers = {'User-Agent': f"multisma2/{_VERSION}", 'Accept-Encoding': 'gzip, deflate'}
+        async with aiohttp.ClientSession(
+                connector=connector, timeout=timeout, headers=headers, auto_decompress=True) as session:
+            self._session = session
+            try:
+                await self._astart()
+                await self._arun()
+            finally:
+                await self._astop()
 
     async def _astart(self):
         """Asynchronous initialization code."""
         config = self._config.multisma2
-        self._session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(ssl=False))
         self._pvsite = PVSite(self._session, config)
-        result = await self._pvsite.start()
+        result = await self._unless_shutdown(self._pvsite.start())
         if not result:
             raise FailedInitialization
 
     async def _arun(self):
         """Asynchronous run code."""
-        await self._pvsite.run()
+        await self._unless_shutdown(self._pvsite.run())
+
+    async def _unless_shutdown(self, coro):
+        """Await a coroutine, cancelling it and raising TerminateSignal if a shutdown is requested."""
+        task = asyncio.ensure_future(coro)
+        shutdown = asyncio.ensure_future(self._shutdown.wait())
+        done, pending = await asyncio.wait({task, shutdown}, return_when=asyncio.FIRST_COMPLETED)
+        for pending_task in pending:
+            pending_task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+        if shutdown in done:
+            raise TerminateSignal
+        return task.result()
 
     async def _astop(self):
         """Asynchronous closing code."""
         _LOGGER.info("Closing multisma2 application")
         if self._pvsite:
             await self._pvsite.stop()
-        if self._session:
-            await self._session.close()
-
-    def _start(self):
-        """Initialize everything prior to running."""
-        self._loop.run_until_complete(self._astart())
-
-    def _run(self):
-        """Run the application."""
-        self._loop.run_until_complete(self._arun())
-
-    def _stop(self):
-        """Cleanup after running."""
-        self._loop.run_until_complete(self._astop())
 
 
 def main():
     """Set up and start multisma2."""
+    # Use uvloop for every event loop created by asyncio.run(), the default
+    # asyncio loop is used when uvloop is not installed or on Windows
+    if uvloop and sys.platform != 'win32':
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+
     logfiles.start()
-    _LOGGER.info(f"multisma2 inverter collection utility {version.get_version()}, PID is {os.getpid()}")
+    _LOGGER.info(f"multisma2 inverter collection utility {_VERSION}, PID is {os.getpid()}")
 
     try:
         config = read_config()
@@ -125,11 +171,14 @@ def main():
         _LOGGER.error(f"{e}")
     except Exception as e:
         _LOGGER.error(f"Unexpected exception: {e}")
+    finally:
+        logfiles.stop()
 
 
 if __name__ == "__main__":
     # make sure we can run multisma2
-    if sys.version_info[0] >= 3 and sys.version_info[1] >= 8:
+    if sys.version_info >= (3, 8):
         main()
     else:
-        print("python 3.8 or better required")
+        _LOGGER.error("python 3.8 or better required")
+        sys.exit(1)
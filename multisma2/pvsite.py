@@ -4,9 +4,10 @@ import asyncio
 import datetime
 import time
 import logging
+from collections import defaultdict
 from dateutil import tz
 
-from astral.sun import sun, elevation, azimuth
+from astral.sun import sun, zenith_and_azimuth
 from astral import LocationInfo, now
 
 import clearsky
@@ -15,7 +16,7 @@ from inverter import Inverter
 from influx import InfluxDB
 import mqtt
 
-from exceptions import FailedInitialization
+from exceptions import FailedInitialization, AbnormalCompletion
 
 
 _LOGGER = logging.getLogger('multisma2')
@@ -48,12 +49,12 @@ MQTT_TOPICS = {
 }
 
 # These are keys that we calculate a total across all inverters (if multiple inverters)
-AGGREGATE_KEYS = [
+AGGREGATE_KEYS = frozenset([
     '6100_40263F00',    # AC grid power (totals for site and each inverter)
     '6100_0046C200',    # PV generation power (instantaneous)
     '6400_0046C300',    # Meter count and PV gen. meter (total Wh meter)
     '6380_40251E00',    # DC power (totals for site and each inverter)
-]
+])
 
 SITE_SNAPSHOT = [       # Instantaneous values
     '6100_40263F00',    # AC grid power (by inverter/site)
@@ -69,6 +70,33 @@ SITE_STATUS = [
     '6180_08414C00',    # Status: Condition
 ]
 
+# Production periods tracked by the inverters
+PERIODS = ('today', 'month', 'year', 'lifetime')
+PRODUCTION_TOPICS = {period: f"production/{period}" for period in PERIODS}
+CO2_TOPICS = {period: f"co2avoided/{period}" for period in PERIODS}
+
+PRODUCTION_SETTINGS = {
+    'today': {'unit': 'kWh', 'scale': 0.001, 'precision': 3},
+    'month': {'unit': 'kWh', 'scale': 0.001, 'precision': 3},
+    'year': {'unit': 'kWh', 'scale': 0.001, 'precision': 3},
+    'lifetime': {'unit': 'kWh', 'scale': 0.001, 'precision': 3},
+}
+
+# CO2 values are also multiplied by the site 'co2_avoided' factor (kg/kWh)
+CO2_SETTINGS = {
+    'today': {'unit': 'kg', 'scale': 0.001, 'precision': 2},
+    'month': {'unit': 'kg', 'scale': 0.001, 'precision': 0},
+    'year': {'unit': 'kg', 'scale': 0.001, 'precision': 0},
+    'lifetime': {'unit': 'kg', 'scale': 0.001, 'precision': 0},
+}
+
+# Database pruning deletes everything older than the kept days
+_PRUNE_START = datetime.datetime(1970, 1, 1).isoformat() + 'Z'
+
+# Ordinal suffixes for day_of_year() and the cached result for today
+_DOY_SUFFIXES = {1: 'st', 2: 'nd', 3: 'rd'}
+_DOY_CACHE = {}
+
 
 class PVSite():
     """Class to describe a PV site with one or more inverters."""
@@ -78,15 +106,18 @@ class PVSite():
         self._session = session
         self._config = config
         self._inverters = []
+        self._multiple_inverters = False
         self._siteinfo = None
+        self._observer = None
         self._tzinfo = None
-        self._tasks = None
-        self._task_gather = None
-        self._total_production = None
-        self._cached_keys = []
+        self._tasks = []
+        self._total_production = {}
+        self._cached_keys = frozenset()
         self._daylight = None
         self._dawn = None
         self._dusk = None
+        self._sun_events = {}
+        self._solar_refreshed = asyncio.Event()
         self._influxdb_client = InfluxDB(config)
         self._sampling_fast = _DEFAULT_FAST
         self._sampling_medium = _DEFAULT_MEDIUM
@@ -96,8 +127,15 @@ class PVSite():
         """Initialize the PVSite object."""
         config = self._config
 
+        # Let gathered coroutines that complete without blocking (cached inverter states)
+        # finish immediately instead of being scheduled, needs Python 3.12 or later
+        if hasattr(asyncio, 'eager_task_factory'):
+            asyncio.get_running_loop().set_task_factory(asyncio.eager_task_factory)
+
         site = config.site
         self._siteinfo = LocationInfo(site.name, site.region, site.tz, site.latitude, site.longitude)
+        # LocationInfo.observer builds a new Observer on each access
+        self._observer = self._siteinfo.observer
         self._tzinfo = tz.gettz(config.site.tz)
 
         for inverter in config.inverters:
@@ -108,8 +146,9 @@ class PVSite():
             except Exception as e:
                 _LOGGER.error(f"An error occurred while setting up the inverters: {e}")
                 return False
+        self._multiple_inverters = len(self._inverters) > 1
 
-        if 'influxdb2' in config.keys():
+        if 'influxdb2' in config:
             try:
                 result = self._influxdb_client.start()
                 if result is False:
@@ -119,13 +158,13 @@ class PVSite():
         else:
             _LOGGER.warning("No support for InfluxDB included in YAML file")
 
-        if 'mqtt' in config.keys():
+        if 'mqtt' in config:
             if not mqtt.start(config=config.mqtt):
                 return False
         else:
             _LOGGER.warning("No support for MQTT included in YAML file")
 
-        if 'settings' in config.keys() and 'sampling' in config.settings.keys():
+        if 'settings' in config and 'sampling' in config.settings:
             self._sampling_fast = config.settings.sampling.get('fast', _DEFAULT_FAST)
             self._sampling_medium = config.settings.sampling.get('medium', _DEFAULT_MEDIUM)
             self._sampling_slow = config.settings.sampling.get('slow', _DEFAULT_SLOW)
@@ -140,7 +179,7 @@ class PVSite():
         if not success:
             return False
 
-        self._cached_keys = inverters[0].get('keys')
+        self._cached_keys = frozenset(inverters[0].get('keys'))
         return True
 
     async def run(self):
@@ -154,12 +193,13 @@ class PVSite():
             self.update_total_production(daylight=True),
         )
 
+        # Only the latest tick is kept, a task that falls behind skips the stale ones
         queues = {
-            'fast': asyncio.Queue(),
-            'medium': asyncio.Queue(),
-            'slow': asyncio.Queue(),
+            'fast': asyncio.Queue(maxsize=1),
+            'medium': asyncio.Queue(maxsize=1),
+            'slow': asyncio.Queue(maxsize=1),
         }
-        self._task_gather = asyncio.gather(
+        self._tasks = [asyncio.ensure_future(coro) for coro in (
             self.daylight(),
             self.midnight(),
             self.scheduler(queues),
@@ -167,24 +207,46 @@ class PVSite():
             self.task_medium(queues.get('medium')),
             self.task_slow(queues.get('slow')),
             self.task_deletions(),
-        )
-        await self._task_gather
+        )]
+
+        # A failing task or an outside cancel takes down all the other tasks
+        try:
+            done, _ = await asyncio.wait(self._tasks, return_when=asyncio.FIRST_EXCEPTION)
+        finally:
+            await self.cancel_tasks()
+        # The site tasks never return, one that fails restarts multisma2 with a fresh session
+        for task in done:
+            try:
+                task.result()
+            except Exception as e:
+                _LOGGER.error(f"Unexpected exception in a site task: {e}")
+                raise AbnormalCompletion from e
+
+    async def cancel_tasks(self):
+        """Cancel the site tasks and wait for them to finish."""
+        tasks, self._tasks = self._tasks, []
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
 
     async def stop(self):
         """Shutdown the site."""
-        if self._task_gather:
-            self._task_gather.cancel()
+        await self.cancel_tasks()
 
         await asyncio.gather(*(inverter.stop() for inverter in self._inverters))
         self._influxdb_client.stop()
+        mqtt.stop()
 
     async def solar_data_update(self) -> None:
         """Update the sun data used to sequence operation."""
         astral_now = now(tzinfo=self._tzinfo)
-        astral = sun(observer=self._siteinfo.observer, tzinfo=self._tzinfo)
+        astral = self.sun_events(astral_now.date())
         self._dawn = astral['dawn']
         self._dusk = astral['dusk']
         self._daylight = self._dawn < astral_now < self._dusk
+        # Wake up the daylight task so it uses the new dawn and dusk times
+        self._solar_refreshed.set()
+        self._solar_refreshed.clear()
         _LOGGER.info(
             f"Dawn occurs at {self._dawn.strftime('%H:%M')}, "
             f"noon is at {astral['noon'].strftime('%H:%M')}, "
@@ -192,6 +254,15 @@ class PVSite():
             f"on this {day_of_year()} day of {astral_now.year}"
         )
 
+    def sun_events(self, date):
+        """Return the dawn, noon, and dusk times for a date, they only change once a day."""
+        events = self._sun_events.get(date, None)
+        if events is None:
+            if len(self._sun_events) > 2:
+                self._sun_events.clear()
+            events = self._sun_events[date] = sun(observer=self._observer, date=date, tzinfo=self._tzinfo)
+        return events
+
     async def daylight(self) -> None:
         """Task to determine when it is daylight and daylight changes."""
         while True:
@@ -204,7 +275,7 @@ class PVSite():
             elif astral_now > self._dusk:
                 self._daylight = False
                 tomorrow = astral_now + datetime.timedelta(days=1)
-                astral = sun(date=tomorrow.date(), observer=self._siteinfo.observer, tzinfo=self._tzinfo)
+                astral = self.sun_events(tomorrow.date())
                 next_event = astral['dawn'] - astral_now
                 info = "Night: inverter data collection is inactive, cached updates being used"
             else:
@@ -216,15 +287,19 @@ class PVSite():
                 _LOGGER.info(f"{info}")
 
             FUDGE = 60
-            await asyncio.sleep(next_event.total_seconds() + FUDGE)
+            sleep = asyncio.ensure_future(asyncio.sleep(next_event.total_seconds() + FUDGE))
+            refreshed = asyncio.ensure_future(self._solar_refreshed.wait())
+            try:
+                await asyncio.wait({sleep, refreshed}, return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                sleep.cancel()
+                refreshed.cancel()
 
     async def midnight(self) -> None:
         """Task to wake up after midnight and update the solar data for the new day."""
+        midnight = datetime.datetime.combine(datetime.date.today() + datetime.timedelta(days=1), datetime.time(0, 1))
         while True:
-            right_now = datetime.datetime.now()
-            tomorrow = right_now + datetime.timedelta(days=1)
-            midnight = datetime.datetime.combine(tomorrow, datetime.time(0, 1))
-            await asyncio.sleep((midnight - right_now).total_seconds())
+            await asyncio.sleep((midnight - datetime.datetime.now()).total_seconds())
 
             await self.solar_data_update()
 
@@ -244,40 +319,44 @@ class PVSite():
             saved_daylight = self._daylight
             self._daylight = True
             await asyncio.gather(*(inverter.read_inverter_production() for inverter in self._inverters))
-            self._influxdb_client.write_history(await self.get_yesterday_production(), 'production/midnight')
+            yesterday, _ = await asyncio.gather(
+                self.get_yesterday_production(),
+                self.update_total_production(daylight=self._daylight),
+            )
+            # Same as publish_sensors(), the synchronous InfluxDB write runs in the default executor
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(None, self._influxdb_client.write_history, yesterday, 'production/midnight')
 
-            await self.update_total_production(daylight=self._daylight)
             sensors = await asyncio.gather(
                 self.production_totalwh(),
                 self.production_history(),
             )
-            for sensor in sensors:
-                if sensor:
-                    mqtt.publish(sensor)
-                    self._influxdb_client.write_sma_sensors(sensor=sensor, timestamp=int(midnight.timestamp()))
+            await self.publish_sensors(sensors, timestamp=int(midnight.timestamp()))
 
             await asyncio.sleep(600)
             self._daylight = saved_daylight
+            midnight += datetime.timedelta(days=1)
 
     async def scheduler(self, queues):
         """Task to schedule actions at regular intervals."""
-        SLEEP = 0.5
-        last_tick = time.time_ns() // 1000000000
+        periods = (self._sampling_fast, self._sampling_medium, self._sampling_slow)
+        last_tick = None
         while True:
+            # Sleep until the next second that is a multiple of one of the sampling periods
+            await asyncio.sleep(min(next_tick(period, time.time()) for period in periods))
             tick = time.time_ns() // 1000000000
-            if tick != last_tick:
-                last_tick = tick
-                if tick % self._sampling_fast == 0:
-                    await asyncio.gather(
-                        self.read_instantaneous(self._daylight),
-                        self.update_total_production(daylight=self._daylight),
-                    )
-                    queues.get('fast').put_nowait(tick)
-                if tick % self._sampling_medium == 0:
-                    queues.get('medium').put_nowait(tick)
-                if tick % self._sampling_slow == 0:
-                    queues.get('slow').put_nowait(tick)
-            await asyncio.sleep(SLEEP)
+            if tick == last_tick:
+                continue
+            last_tick = tick
+            if tick % self._sampling_fast == 0:
+                # The period totals are computed from the inverter readings, so refresh those first
+                await self.read_instantaneous(self._daylight)
+                await self.update_total_production(daylight=self._daylight)
+                put_latest(queues.get('fast'), tick)
+            if tick % self._sampling_medium == 0:
+                put_latest(queues.get('medium'), tick)
+            if tick % self._sampling_slow == 0:
+                put_latest(queues.get('slow'), tick)
 
     async def task_fast(self, queue):
         """Work done at a fast sample rate."""
@@ -288,9 +367,7 @@ class PVSite():
                 self.production_snapshot(),
                 self.status_snapshot(),
             )
-            for sensor in sensors:
-                mqtt.publish(sensor)
-                self._influxdb_client.write_sma_sensors(sensor=sensor, timestamp=timestamp)
+            await self.publish_sensors(sensors, timestamp=timestamp)
 
     async def task_medium(self, queue):
         """Work done at a medium sample rate."""
@@ -301,9 +378,7 @@ class PVSite():
                 self.production_totalwh(),
                 self.production_history(),
             )
-            for sensor in sensors:
-                mqtt.publish(sensor)
-                self._influxdb_client.write_sma_sensors(sensor=sensor, timestamp=timestamp)
+            await self.publish_sensors(sensors, timestamp=timestamp)
 
     async def task_slow(self, queue):
         """Work done at a slow sample rate."""
@@ -316,9 +391,17 @@ class PVSite():
                 self.sun_irradiance(timestamp=timestamp),
                 self.sun_position(),
             )
-            for sensor in sensors:
-                mqtt.publish(sensor)
-                self._influxdb_client.write_sma_sensors(sensor=sensor, timestamp=timestamp)
+            await self.publish_sensors(sensors, timestamp=timestamp)
+
+    async def publish_sensors(self, sensors, timestamp) -> None:
+        """Publish the sensors using MQTT and write them to InfluxDB."""
+        sensors = [sensor for sensor in sensors if sensor]
+        mqtt.publish_many(sensors)
+
+        # InfluxDB writes are synchronous HTTP requests, write all the sensors in one request
+        # from the default executor
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self._influxdb_client.write_sma_sensors_batch, sensors, timestamp)
 
     async def task_deletions(self) -> None:
         """Task to remove older database entries."""
@@ -328,8 +411,8 @@ class PVSite():
 
         pruning_tasks = []
         config = self._config
-        if 'influxdb2' in config.keys():
-            if 'pruning' in config.influxdb2.keys():
+        if 'influxdb2' in config:
+            if 'pruning' in config.influxdb2:
                 for pruning_task in config.influxdb2.pruning:
                     for task in pruning_task.values():
                         name = task.get('name', None)
@@ -340,17 +423,20 @@ class PVSite():
                             pruning_tasks.append(new_task)
                             _LOGGER.debug(f"Added database pruning task: {new_task}")
 
+        tomorrow = datetime.date.today() + datetime.timedelta(days=1)
+        next_pruning = datetime.datetime.combine(tomorrow, datetime.time(2, 30))
         while True:
-            right_now = datetime.datetime.now()
-            midnight = datetime.datetime.combine(right_now + datetime.timedelta(days=1), datetime.time(2, 30))
-            await asyncio.sleep((midnight - right_now).total_seconds())
+            await asyncio.sleep((next_pruning - datetime.datetime.now()).total_seconds())
+            next_pruning += datetime.timedelta(days=1)
 
             try:
-                start = datetime.datetime(1970, 1, 1).isoformat() + 'Z'
+                today = datetime.datetime.now(tz=datetime.timezone.utc).date()
                 for task in pruning_tasks:
-                    stop = datetime.datetime.combine(datetime.datetime.now(
-                    ) - datetime.timedelta(days=keep_last), datetime.time(0, 0)).isoformat() + 'Z'
-                    delete_api.delete(start, stop, predicate, bucket=bucket, org=org)
+                    keep_last = task['keep_last']
+                    predicate = task['predicate']
+                    stop = datetime.datetime.combine(
+                        today - datetime.timedelta(days=keep_last), datetime.time(0, 0)).isoformat() + 'Z'
+                    delete_api.delete(_PRUNE_START, stop, predicate, bucket=bucket, org=org)
                     _LOGGER.debug(f"Pruned database '{bucket}': {predicate}, kept last {keep_last} days")
             except Exception as e:
                 _LOGGER.debug(f"Unexpected exception in task_deletions(): {e}")
@@ -383,22 +469,16 @@ class PVSite():
     async def get_production_history(self, start, stop):
         """Get the production totals for a given period and create a site total."""
         production = await asyncio.gather(*(inverter.read_history(start, stop) for inverter in self._inverters))
-        total = {}
+        total = defaultdict(int)
         for inverter in production:
-            for i in range(1, len(inverter)):
-                t = inverter[i]['t']
-                v = inverter[i]['v']
-                if v is None:
-                    continue
-                if t in total:
-                    total[t] += v
-                else:
-                    total[t] = v
-
-        site_total = []
-        for t, v in total.items():
-            site_total.append({'t': t, 'v': v})
-        site_total.insert(0, {'inverter': 'site'})
+            # The first entry is the inverter name
+            for entry in inverter[1:]:
+                v = entry['v']
+                if v is not None:
+                    total[entry['t']] += v
+
+        site_total = [{'inverter': 'site'}]
+        site_total.extend({'t': t, 'v': v} for t, v in total.items())
         production.append(site_total)
         return production
 
@@ -407,16 +487,20 @@ class PVSite():
         if not daylight:
             return
 
-        total_productions = await self.production_totalwh()
+        # Fetch the current totals and the starting values for every period and inverter at once
+        inverter_count = len(self._inverters)
+        total_productions, *start_productions = await asyncio.gather(
+            self.production_totalwh(),
+            *(inverter.start_production(period) for period in PERIODS for inverter in self._inverters)
+        )
         # [{'sb71': 4376401, 'sb72': 4366596, 'sb51': 3121662, 'site': 11864659, 'topic': 'production/total_wh'}]
         # _LOGGER.debug(f"total_productions: {total_productions}")
-        updated_total_production = []
+
+        updated_total_production = {}
         for total_production in total_productions:
-            for period in ['today', 'month', 'year', 'lifetime']:
+            for index, period in enumerate(PERIODS):
                 period_stats = {}
-                inverter_periods = await asyncio.gather(
-                    *(inverter.start_production(period) for inverter in self._inverters)
-                )
+                inverter_periods = start_productions[index * inverter_count:(index + 1) * inverter_count]
 
                 total = 0
                 for inverter in inverter_periods:
@@ -426,37 +510,23 @@ class PVSite():
                         period_stats[inverter_name] = period_total
 
                     period_stats['site'] = total
-                    period_stats['period'] = period
 
-                updated_total_production.append(period_stats)
+                updated_total_production[period] = period_stats
 
         _LOGGER.debug(f"update_total_production(): {updated_total_production}")
-        # [{'sb71': 157, 'site': 442, 'period': 'today', 'sb72': 176, 'sb51': 109},
-        #  {'sb71': 97028, 'site': 260611, 'period': 'month', 'sb72': 97827, 'sb51': 65756},
-        #  {'sb71': 97028, 'site': 260611, 'period': 'year', 'sb72': 97827, 'sb51': 65756},
-        #  {'sb71': 4376363, 'site': 11864551, 'period': 'lifetime', 'sb72': 4366554, 'sb51': 3121634}]
+        # {'today': {'sb71': 157, 'site': 442, 'sb72': 176, 'sb51': 109},
+        #  'month': {'sb71': 97028, 'site': 260611, 'sb72': 97827, 'sb51': 65756},
+        #  'year': {'sb71': 97028, 'site': 260611, 'sb72': 97827, 'sb51': 65756},
+        #  'lifetime': {'sb71': 4376363, 'site': 11864551, 'sb72': 4366554, 'sb51': 3121634}}
         self._total_production = updated_total_production
 
     async def production_history(self):
         """Get the daily, monthly, yearly, and lifetime production values."""
-        PRODUCTION_SETTINGS = {
-            'today': {'unit': 'kWh', 'scale': 0.001, 'precision': 3},
-            'month': {'unit': 'kWh', 'scale': 0.001, 'precision': 3},
-            'year': {'unit': 'kWh', 'scale': 0.001, 'precision': 3},
-            'lifetime': {'unit': 'kWh', 'scale': 0.001, 'precision': 3},
-        }
-
         histories = []
-        for period in ['today', 'month', 'year', 'lifetime']:
-            settings = PRODUCTION_SETTINGS.get(period)
-            tp = self.find_total_production(period)
-            period = tp.pop('period')
-            history = {}
-            for key, value in tp.items():
-                production = value * settings['scale']
-                history[key] = round(production, settings['precision']) if settings['precision'] else int(production)
-
-            history['topic'] = 'production/' + period
+        for period in PERIODS:
+            settings = PRODUCTION_SETTINGS[period]
+            history = scale_period(self.find_total_production(period), settings['scale'], settings['precision'])
+            history['topic'] = PRODUCTION_TOPICS[period]
             histories.append(history)
 
         _LOGGER.debug(f"production_history(): {histories}")
@@ -469,8 +539,9 @@ class PVSite():
     async def sun_position(self):
         """Calculate where the sun is in the sky."""
         astral_now = now(tzinfo=self._tzinfo)
-        sun_elevation = elevation(observer=self._siteinfo.observer, dateandtime=astral_now)
-        sun_azimuth = azimuth(observer=self._siteinfo.observer, dateandtime=astral_now)
+        # elevation() and azimuth() each compute the full solar position, do it once
+        sun_zenith, sun_azimuth = zenith_and_azimuth(observer=self._observer, dateandtime=astral_now)
+        sun_elevation = 90.0 - sun_zenith
         results = [{'topic': 'sun/position', 'elevation': round(sun_elevation, 1), 'azimuth': round(sun_azimuth, 1)}]
         return results
 
@@ -486,24 +557,12 @@ class PVSite():
     async def co2_avoided(self):
         """Calculate the CO2 avoided by solar production."""
         CO2_AVOIDANCE_KG = self._config.site.co2_avoided
-        CO2_SETTINGS = {
-            'today': {'scale': 0.001, 'unit': 'kg', 'precision': 2, 'factor': CO2_AVOIDANCE_KG},
-            'month': {'scale': 0.001, 'unit': 'kg', 'precision': 0, 'factor': CO2_AVOIDANCE_KG},
-            'year': {'scale': 0.001, 'unit': 'kg', 'precision': 0, 'factor': CO2_AVOIDANCE_KG},
-            'lifetime': {'scale': 0.001, 'unit': 'kg', 'precision': 0, 'factor': CO2_AVOIDANCE_KG},
-        }
-
         co2avoided = []
-        for period in ['today', 'month', 'year', 'lifetime']:
-            settings = CO2_SETTINGS.get(period)
-            tp = self.find_total_production(period)
-            period = tp.pop('period')
-            co2avoided_period = {}
-            for key, value in tp.items():
-                co2 = value * settings['scale'] * settings['factor']
-                co2avoided_period[key] = round(co2, settings['precision']) if settings['precision'] else int(co2)
-
-            co2avoided_period['topic'] = 'co2avoided/' + period
+        for period in PERIODS:
+            settings = CO2_SETTINGS[period]
+            co2avoided_period = scale_period(
+                self.find_total_production(period), settings['scale'], settings['precision'], CO2_AVOIDANCE_KG)
+            co2avoided_period['topic'] = CO2_TOPICS[period]
             co2avoided.append(co2avoided_period)
 
         return co2avoided
@@ -540,31 +599,33 @@ class PVSite():
 
     async def get_composite(self, keys):
         """Get the key values of each inverter and optionally create a site total."""
-        sensors = []
-        for key in keys:
-            if self.cached_key(key):
-                inverters = await asyncio.gather(*(inverter.get_state(key) for inverter in self._inverters))
-            else:
-                inverters = await asyncio.gather(*(inverter.read_key(key) for inverter in self._inverters))
+        # Read every key from every inverter at once, keys missing from the cache are read from the inverters
+        cached = {key: self.cached_key(key) for key in keys}
+        for key, is_cached in cached.items():
+            if not is_cached:
                 _LOGGER.warning(f"get_composite(): non-cached key '{key}'")
+        results = await asyncio.gather(*(
+            inverter.get_state(key) if cached[key] else inverter.read_key(key)
+            for key in keys for inverter in self._inverters
+        ))
 
+        sensors = []
+        inverter_count = len(self._inverters)
+        for index, key in enumerate(keys):
+            inverters = results[index * inverter_count:(index + 1) * inverter_count]
             composite = {}
             total = 0
-            calculate_total = AGGREGATE_KEYS.count(key) and (len(inverters) > 1)
+            calculate_total = self._multiple_inverters and key in AGGREGATE_KEYS
             for inverter in inverters:
-                name = inverter.get('name')
                 result = inverter.get(key)
                 if not result:
                     continue
+                name = inverter['name']
                 val = result.get('val', None)
                 precision = result.get('precision', None)
-                if isinstance(val, dict):
-                    if calculate_total:
-                        subtotal = val.get(name)
-                        total += subtotal
-                else:
-                    if calculate_total:
-                        total += val
+                if calculate_total:
+                    # Multi-string values carry the inverter total under the inverter name
+                    total += val[name] if isinstance(val, dict) else val
 
                 if precision is not None:
                     composite['precision'] = precision
@@ -584,10 +645,7 @@ class PVSite():
 
     def find_total_production(self, period):
         """Find the total production for a given period."""
-        for d_period in self._total_production:
-            if d_period.get('period') is period:
-                return d_period.copy()
-        return None
+        return self._total_production.get(period, None)
 
     def is_daylight(self) -> bool:
         """True if currently in daylight conditions."""
@@ -596,6 +654,31 @@ class PVSite():
 
 def day_of_year() -> str:
     """Return the DOY in a pretty form for logging."""
-    doy = int(datetime.datetime.now().strftime('%j'))
-    suffixes = ['st', 'nd', 'rd', 'th']
-    return f"{doy}{suffixes[3 if doy >= 4 else doy-1]}"
+    today = datetime.date.today()
+    if _DOY_CACHE.get('date') != today:
+        doy = today.timetuple().tm_yday
+        suffix = 'th' if 11 <= doy % 100 <= 13 else _DOY_SUFFIXES.get(doy % 10, 'th')
+        _DOY_CACHE['date'] = today
+        _DOY_CACHE['doy'] = f"{doy}{suffix}"
+    return _DOY_CACHE['doy']
+
+
+def scale_period(period_total, scale, precision, factor=1):
+    """Scale the inverter and site totals for a period, a precision of 0 truncates to int."""
+    multiplier = scale * factor
+    if precision:
+        return {key: round(value * multiplier, precision) for key, value in period_total.items()}
+    return {key: int(value * multiplier) for key, value in period_total.items()}
+
+
+def put_latest(queue, item) -> None:
+    """Queue an item, replacing any item that has not been taken yet."""
+    if queue.full():
+        queue.get_nowait()
+        queue.task_done()
+    queue.put_nowait(item)
+
+
+def next_tick(period, now) -> float:
+    """Return the seconds from now until the next multiple of period."""
+    return period - (now % period)
@@ -7,10 +7,10 @@ import sys
 from config.configuration import Configuration
 from pathlib import Path
 import yaml
-from config import config_from_yaml
+from config import config_from_dict
 
 from collections import OrderedDict
-from typing import Dict, List, TextIO, TypeVar, Union
+from typing import Dict, List, Optional, TextIO, Tuple, TypeVar, Union
 
 from exceptions import FailedInitialization
 
@@ -22,34 +22,37 @@ JSON_TYPE = Union[List, Dict, str]  # pylint: disable=invalid-name
 DICT_T = TypeVar("DICT_T", bound=Dict)  # pylint: disable=invalid-name
 
 _LOGGER = logging.getLogger("multisma2")
-_SECRET_CACHE: Dict[str, JSON_TYPE] = {}
+_SECRET_CACHE: Dict[str, Tuple[Optional[int], JSON_TYPE]] = {}
+_CONFIG_CACHE: Dict[str, Tuple[Tuple[int, int], Dict[str, Optional[int]], Configuration]] = {}
 
 
 def buildYAMLExceptionString(exception, file='multisma2'):
     e = exception
     try:
+        basename = os.path.basename
         type = ''
-        file = file
         line = 0
         column = 0
         info = ''
 
-        if e.args[0]:
-            type = e.args[0]
-            type += ' '
+        # MarkedYAMLError args are (context, context_mark, problem, problem_mark), pad short tuples
+        context, context_mark, problem, problem_mark = (tuple(e.args) + (None,) * 4)[:4]
 
-        if e.args[1]:
-            file = os.path.basename(e.args[1].name)
-            line = e.args[1].line
-            column = e.args[1].column
+        if context:
+            type = f"{context} "
 
-        if e.args[2]:
-            info = os.path.basename(e.args[2])
+        if context_mark is not None:
+            file = basename(context_mark.name)
+            line = context_mark.line
+            column = context_mark.column
 
-        if e.args[3]:
-            file = os.path.basename(e.args[3].name)
-            line = e.args[3].line
-            column = e.args[3].column
+        if problem:
+            info = basename(problem)
+
+        if problem_mark is not None:
+            file = basename(problem_mark.name)
+            line = problem_mark.line
+            column = problem_mark.column
 
         errmsg = f"YAML file error {type}in {file}:{line}, column {column}: {info}"
 
@@ -63,15 +66,13 @@ class ConfigError(Exception):
     """General YAML configuration file exception."""
 
 
-class FullLineLoader(yaml.FullLoader):
-    """Loader class that keeps track of line numbers."""
+class ConfigLoader(getattr(yaml, 'CSafeLoader', yaml.SafeLoader)):
+    """Loader class for the configuration and secrets files, uses libyaml when available."""
 
-    def compose_node(self, parent: yaml.nodes.Node, index: int) -> yaml.nodes.Node:
-        """Annotate a node with the first line it was seen."""
-        last_line: int = self.line
-        node: yaml.nodes.Node = super().compose_node(parent, index)
-        node.__line__ = last_line + 1  # type: ignore
-        return node
+    def __init__(self, stream) -> None:
+        """Save the file name, the libyaml parser does not expose it for !secret lookups."""
+        super().__init__(stream)
+        self.name = getattr(stream, 'name', '<file>')
 
 
 def load_yaml(fname: str) -> JSON_TYPE:
@@ -89,32 +90,46 @@ def parse_yaml(content: Union[str, TextIO]) -> JSON_TYPE:
     try:
         # If configuration file is empty YAML returns None
         # We convert that to an empty dict
-        return yaml.load(content, Loader=FullLineLoader) or OrderedDict()
+        return yaml.load(content, Loader=ConfigLoader) or OrderedDict()
     except yaml.YAMLError as exc:
         _LOGGER.error(str(exc))
         raise ConfigError(exc) from exc
 
 
+def _mtime_ns(path: str) -> Optional[int]:
+    """Return the modification time of a file, None if it doesn't exist."""
+    try:
+        return os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
 def _load_secret_yaml(secret_path: str) -> JSON_TYPE:
     """Load the secrets yaml from path."""
     secret_path = os.path.join(secret_path, SECRET_YAML)
-    if secret_path in _SECRET_CACHE:
-        return _SECRET_CACHE[secret_path]
 
-    _LOGGER.debug("Loading %s", secret_path)
-    try:
-        secrets = load_yaml(secret_path)
-        if not isinstance(secrets, dict):
-            raise ConfigError("Secrets is not a dictionary")
+    # Cached secrets (or a missing file) are reused until the file changes
+    mtime = _mtime_ns(secret_path)
+    cached = _SECRET_CACHE.get(secret_path, None)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
 
-    except FileNotFoundError:
-        secrets = {}
+    secrets = {}
+    if mtime is not None:
+        _LOGGER.debug("Loading %s", secret_path)
+        try:
+            secrets = load_yaml(secret_path)
+            if not isinstance(secrets, dict):
+                raise ConfigError("Secrets is not a dictionary")
+
+        except FileNotFoundError:
+            secrets = {}
 
-    _SECRET_CACHE[secret_path] = secrets
+    _SECRET_CACHE[secret_path] = (mtime, secrets)
     return secrets
 
 
-def secret_yaml(loader: FullLineLoader, node: yaml.nodes.Node) -> JSON_TYPE:
+def secret_yaml(loader: ConfigLoader, node: yaml.nodes.Node) -> JSON_TYPE:
     """Load secrets and embed it into the configuration YAML."""
     if os.path.basename(loader.name) == SECRET_YAML:
         raise ConfigError(f"{SECRET_YAML}: attempt to load secret from within secrets file")
@@ -136,187 +151,139 @@ def secret_yaml(loader: FullLineLoader, node: yaml.nodes.Node) -> JSON_TYPE:
     raise ConfigError(f"Secret '{node.value}' not defined")
 
 
-def check_required_keys(yaml, required, path='') -> bool:
-    passed = True
+# Supported YAML options, required options must be present and match the type when one is given
+_REQUIRED_KEYS = [
+    {
+        'multisma2': {'required': True, 'keys':
+                      [
+                          {'site': {'required': True, 'keys': [
+                              {'name': {'required': True, 'keys': [], 'type': str}},
+                              {'region': {'required': True, 'keys': [], 'type': str}},
+                              {'tz': {'required': True, 'keys': [], 'type': str}},
+                              {'latitude': {'required': True, 'keys': [], 'type': float}},
+                              {'longitude': {'required': True, 'keys': [], 'type': float}},
+                              {'elevation': {'required': True, 'keys': [], 'type': float}},
+                              {'co2_avoided': {'required': True, 'keys': [], 'type': float}},
+                          ]}},
+                          {'solar_properties': {'required': True, 'keys': [
+                              {'azimuth': {'required': True, 'keys': [], 'type': float}},
+                              {'tilt': {'required': True, 'keys': [], 'type': float}},
+                              {'area': {'required': True, 'keys': [], 'type': float}},
+                              {'efficiency': {'required': True, 'keys': [], 'type': float}},
+                              {'rho': {'required': True, 'keys': [], 'type': float}},
+                          ]}},
+                          {'influxdb2': {'required': False, 'keys': [
+                              {'enable': {'required': True, 'keys': [], 'type': bool}},
+                              {'org': {'required': True, 'keys': [], 'type': str}},
+                              {'url': {'required': True, 'keys': [], 'type': str}},
+                              {'bucket': {'required': True, 'keys': [], 'type': str}},
+                              {'token': {'required': True, 'keys': [], 'type': str}},
+                              {'pruning': {'required': True, 'keys': [
+                                  {'task': {'required': True, 'keys': [
+                                      {'name': {'required': True, 'keys': [], 'type': str}},
+                                      {'predicate': {'required': True, 'keys': [], 'type': str}},
+                                      {'keep_last': {'required': True, 'keys': [], 'type': int}},
+                                  ]}},
+                              ]}},
+                          ]}},
+                          {'mqtt': {'required': False, 'keys': [
+                              {'enable': {'required': True, 'keys': [], 'type': bool}},
+                              {'client': {'required': True, 'keys': [], 'type': str}},
+                              {'ip': {'required': True, 'keys': [], 'type': str}},
+                              {'port': {'required': True, 'keys': [], 'type': int}},
+                              {'username': {'required': True, 'keys': [], 'type': str}},
+                              {'password': {'required': True, 'keys': [], 'type': str}},
+                          ]}},
+                          {'inverters': {'required': True, 'keys': [
+                              {'inverter': {'required': True, 'keys': [
+                                  {'name': {'required': True, 'keys': [], 'type': str}},
+                                  {'url': {'required': True, 'keys': [], 'type': str}},
+                                  {'username': {'required': True, 'keys': [], 'type': str}},
+                                  {'password': {'required': True, 'keys': [], 'type': str}},
+                              ]}},
+                          ]}},
+                          {'settings': {'required': False, 'keys': [
+                              {'sampling': {'required': False, 'keys': [
+                                  {'fast': {'required': False, 'keys': [], 'type': int}},
+                                  {'medium': {'required': False, 'keys': [], 'type': int}},
+                                  {'slow': {'required': False, 'keys': [], 'type': int}},
+                              ]}},
+                          ]}},
+                      ],
+                      },
+    },
+]
 
+
+def _compile_schema(required) -> Dict:
+    """Flatten a list of single key schema dictionaries into {key: (required, type, subkey schema)}."""
+    schema = {}
     for keywords in required:
-        for rk, rv in keywords.items():
-            currentpath = path + rk if path == '' else path + '.' + rk
-
-            requiredKey = rv.get('required')
-            requiredSubkeys = rv.get('keys')
-            keyType = rv.get('type', None)
-            typeStr = '' if not keyType else f" (type is '{keyType.__name__}')"
-
-            if not yaml:
-                raise FailedInitialization(
-                    f"YAML file is corrupt or truncated, expecting to find '{rk}' and found nothing")
-
-            if isinstance(yaml, list):
-                for index, element in enumerate(yaml):
-                    path = f"{currentpath}[{index}]"
-
-                    yamlKeys = element.keys()
-                    if requiredKey:
-                        if rk not in yamlKeys:
-                            _LOGGER.error(f"'{currentpath}' is required for operation {typeStr}")
-                            passed = False
-                            continue
-
-                    yamlValue = dict(element).get(rk, None)
-                    if yamlValue is None:
-                        return passed
-
-                    if rk in yamlKeys and keyType and not isinstance(yamlValue, keyType):
-                        _LOGGER.error(f"'{currentpath}' should be type '{keyType.__name__}'")
-                        passed = False
-
-                    if isinstance(requiredSubkeys, list):
-                        if len(requiredSubkeys):
-                            passed = check_required_keys(yamlValue, requiredSubkeys, path) and passed
-                    else:
-                        raise FailedInitialization(Exception('Unexpected YAML checking error'))
-            elif isinstance(yaml, dict) or isinstance(yaml, Configuration):
-                yamlKeys = yaml.keys()
-                if requiredKey:
-                    if rk not in yamlKeys:
-                        _LOGGER.error(f"'{currentpath}' is required for operation {typeStr}")
-                        passed = False
-                        continue
-
-                yamlValue = dict(yaml).get(rk, None)
-                if yamlValue is None:
-                    return passed
-
-                if rk in yamlKeys and keyType and not isinstance(yamlValue, keyType):
-                    _LOGGER.error(f"'{currentpath}' should be type '{keyType.__name__}'")
-                    passed = False
+        for key, value in keywords.items():
+            schema[key] = (value.get('required'), value.get('type', None), _compile_schema(value.get('keys', [])))
+    return schema
 
-                if isinstance(requiredSubkeys, list):
-                    if len(requiredSubkeys):
-                        passed = check_required_keys(yamlValue, requiredSubkeys, currentpath) and passed
-                else:
-                    raise FailedInitialization('Unexpected YAML checking error')
-            else:
-                raise FailedInitialization('Unexpected YAML checking error')
-    return passed
 
+_SCHEMA = _compile_schema(_REQUIRED_KEYS)
 
-def check_unsupported(yaml, required, path=''):
-    try:
-        passed = True
+
+def check_options(config) -> bool:
+    """Check for missing, mistyped, and unsupported options in a single pass over the configuration."""
+    passed = True
+    pending = [(config, _SCHEMA, '')]
+    while pending:
+        yaml, schema, path = pending.pop()
         if not yaml:
-            raise FailedInitialization("YAML file is corrupt or truncated, nothing left to parse")
+            raise FailedInitialization(
+                f"YAML file is corrupt or truncated, expecting to find '{next(iter(schema))}' and found nothing")
+
         if isinstance(yaml, list):
-            for index, element in enumerate(yaml):
-                for yk in element.keys():
-                    listpath = f"{path}.{yk}[{index}]"
-
-                    yamlValue = dict(element).get(yk, None)
-                    for rk in required:
-                        supportedSubkeys = rk.get(yk, None)
-                        if supportedSubkeys:
-                            break
-                    if not supportedSubkeys:
-                        _LOGGER.info(f"'{listpath}' option is unsupported")
-                        return
-
-                    subkeyList = supportedSubkeys.get('keys', None)
-                    if subkeyList:
-                        passed = check_unsupported(yamlValue, subkeyList, listpath) and passed
+            elements = enumerate(yaml)
         elif isinstance(yaml, dict) or isinstance(yaml, Configuration):
-            for yk in yaml.keys():
-                currentpath = path + yk if path == '' else path + '.' + yk
-
-                yamlValue = dict(yaml).get(yk, None)
-                for rk in required:
-                    supportedSubkeys = rk.get(yk, None)
-                    if supportedSubkeys:
-                        break
-                if not supportedSubkeys:
-                    _LOGGER.info(f"'{currentpath}' option is unsupported")
-                    return
-
-                subkeyList = supportedSubkeys.get('keys', None)
-                if subkeyList:
-                    passed = check_unsupported(yamlValue, subkeyList, currentpath) and passed
+            elements = ((None, yaml),)
         else:
             raise FailedInitialization('Unexpected YAML checking error')
-    except FailedInitialization:
-        raise
-    except Exception as e:
-        raise FailedInitialization(f"Unexpected exception: {e}")
+
+        subtrees = []
+        for index, element in elements:
+            # Convert Configuration objects to dicts once, each conversion copies a level of the tree
+            if isinstance(element, Configuration):
+                element = dict(element)
+            elif not isinstance(element, dict):
+                raise FailedInitialization('Unexpected YAML checking error')
+
+            for yk, yamlValue in element.items():
+                currentpath = yk if path == '' else path + '.' + yk
+                subpath = currentpath if index is None else f"{currentpath}[{index}]"
+                supported = schema.get(yk, None)
+                if supported is None:
+                    _LOGGER.info(f"'{subpath}' option is unsupported")
+                    continue
+                # An option with no value fails the type check, a section with no value fails the truncated check
+                _, keyType, requiredSubkeys = supported
+                if keyType and not isinstance(yamlValue, keyType):
+                    _LOGGER.error(f"'{currentpath}' should be type '{keyType.__name__}'")
+                    passed = False
+
+                if requiredSubkeys:
+                    subtrees.append((yamlValue, requiredSubkeys, subpath))
+
+            for rk, (requiredKey, keyType, _) in schema.items():
+                if requiredKey and rk not in element:
+                    currentpath = rk if path == '' else path + '.' + rk
+                    typeStr = '' if not keyType else f" (type is '{keyType.__name__}')"
+                    _LOGGER.error(f"'{currentpath}' is required for operation {typeStr}")
+                    passed = False
+
+        # Check the subtrees depth first, in the order they appear in the YAML file
+        pending.extend(reversed(subtrees))
     return passed
 
 
 def check_config(config):
     """Check that the important options are present and unknown options aren't."""
-
-    required_keys = [
-        {
-            'multisma2': {'required': True, 'keys':
-                          [
-                              {'site': {'required': True, 'keys': [
-                                  {'name': {'required': True, 'keys': [], 'type': str}},
-                                  {'region': {'required': True, 'keys': [], 'type': str}},
-                                  {'tz': {'required': True, 'keys': [], 'type': str}},
-                                  {'latitude': {'required': True, 'keys': [], 'type': float}},
-                                  {'longitude': {'required': True, 'keys': [], 'type': float}},
-                                  {'elevation': {'required': True, 'keys': [], 'type': float}},
-                                  {'co2_avoided': {'required': True, 'keys': [], 'type': float}},
-                              ]}},
-                              {'solar_properties': {'required': True, 'keys': [
-                                  {'azimuth': {'required': True, 'keys': [], 'type': float}},
-                                  {'tilt': {'required': True, 'keys': [], 'type': float}},
-                                  {'area': {'required': True, 'keys': [], 'type': float}},
-                                  {'efficiency': {'required': True, 'keys': [], 'type': float}},
-                                  {'rho': {'required': True, 'keys': [], 'type': float}},
-                              ]}},
-                              {'influxdb2': {'required': False, 'keys': [
-                                  {'enable': {'required': True, 'keys': [], 'type': bool}},
-                                  {'org': {'required': True, 'keys': [], 'type': str}},
-                                  {'url': {'required': True, 'keys': [], 'type': str}},
-                                  {'bucket': {'required': True, 'keys': [], 'type': str}},
-                                  {'token': {'required': True, 'keys': [], 'type': str}},
-                                  {'pruning': {'required': True, 'keys': [
-                                      {'task': {'required': True, 'keys': [
-                                          {'name': {'required': True, 'keys': [], 'type': str}},
-                                          {'predicate': {'required': True, 'keys': [], 'type': str}},
-                                          {'keep_last': {'required': True, 'keys': [], 'type': int}},
-                                      ]}},
-                                  ]}},
-                              ]}},
-                              {'mqtt': {'required': False, 'keys': [
-                                  {'enable': {'required': True, 'keys': [], 'type': bool}},
-                                  {'client': {'required': True, 'keys': [], 'type': str}},
-                                  {'ip': {'required': True, 'keys': [], 'type': str}},
-                                  {'port': {'required': True, 'keys': [], 'type': int}},
-                                  {'username': {'required': True, 'keys': [], 'type': str}},
-                                  {'password': {'required': True, 'keys': [], 'type': str}},
-                              ]}},
-                              {'inverters': {'required': True, 'keys': [
-                                  {'inverter': {'required': True, 'keys': [
-                                      {'name': {'required': True, 'keys': [], 'type': str}},
-                                      {'url': {'required': True, 'keys': [], 'type': str}},
-                                      {'username': {'required': True, 'keys': [], 'type': str}},
-                                      {'password': {'required': True, 'keys': [], 'type': str}},
-                                  ]}},
-                              ]}},
-                              {'settings': {'required': False, 'keys': [
-                                  {'sampling': {'required': False, 'keys': [
-                                      {'fast': {'required': False, 'keys': [], 'type': int}},
-                                      {'medium': {'required': False, 'keys': [], 'type': int}},
-                                      {'slow': {'required': False, 'keys': [], 'type': int}},
-                                  ]}},
-                              ]}},
-                          ],
-                          },
-        },
-    ]
-
     try:
-        result = check_required_keys(dict(config), required_keys)
-        check_unsupported(dict(config), required_keys)
+        result = check_options(config)
     except FailedInitialization:
         raise
     except Exception as e:
@@ -327,11 +294,24 @@ def check_config(config):
 def read_config():
     """Open the YAML configuration file and check the contents"""
     try:
-        yaml.FullLoader.add_constructor('!secret', secret_yaml)
+        ConfigLoader.add_constructor('!secret', secret_yaml)
         yaml_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), CONFIG_YAML)
-        config = config_from_yaml(data=yaml_file, read_from_file=True)
+
+        # Reuse the checked configuration until the file or one of the secrets files changes
+        st = os.stat(yaml_file)
+        stamp = (st.st_mtime_ns, st.st_size)
+        cached = _CONFIG_CACHE.get(yaml_file, None)
+        if cached is not None and cached[0] == stamp:
+            if all(_mtime_ns(path) == mtime for path, mtime in cached[1].items()):
+                return cached[2]
+
+        with open(yaml_file, encoding="utf-8") as conf_file:
+            config = config_from_dict(yaml.load(conf_file, Loader=ConfigLoader) or {})
         if config:
             config = check_config(config)
+        if config:
+            secrets = {path: mtime for path, (mtime, _) in _SECRET_CACHE.items()}
+            _CONFIG_CACHE[yaml_file] = (stamp, secrets, config)
         return config
     except ConfigError as e:
         raise FailedInitialization(f"ConfigError exception: {e}")
@@ -342,6 +322,11 @@ def read_config():
         raise FailedInitialization(f"Unexpected exception: {error_message}")
 
 
+def clear_config_cache() -> None:
+    """Forget the cached configuration, the next read_config() parses and checks the file again."""
+    _CONFIG_CACHE.clear()
+
+
 def retrieve_options(config, key, option_list) -> dict:
     """Retrieve requested options."""
     if key not in config.keys():
@@ -367,7 +352,7 @@ def retrieve_options(config, key, option_list) -> dict:
 
 
 if __name__ == '__main__':
-    if sys.version_info[0] >= 3 and sys.version_info[1] >= 8:
+    if sys.version_info >= (3, 8):
         config = read_config()
     else:
         print("python 3.8 or better required")
@@ -11,6 +11,14 @@ import async_timeout
 import jmespath
 from aiohttp import client_exceptions
 
+try:
+    import orjson
+    _json_dumps = orjson.dumps
+    _json_loads = orjson.loads
+except ImportError:
+    _json_dumps = json.dumps
+    _json_loads = json.loads
+
 from exceptions import SmaException
 
 
@@ -18,10 +26,16 @@ _LOGGER = logging.getLogger('multisma2')
 
 USERS = {'user': 'usr', 'installer': 'istl'}
 
+# Every request posts a JSON payload
+_HEADERS = {'content-type': 'application/json'}
+
 JMESPATH_BASE = 'result.*'
 JMESPATH_VAL_IDX = '"1"[{}].val'
 JMESPATH_VAL = 'val'
 
+# Compiled once, the session ID is extracted from every login reply
+_SID_EXPR = jmespath.compile('result.sid')
+
 URL_LOGIN = '/dyn/login.json'
 URL_LOGOUT = '/dyn/logout.json'
 URL_VALUES = '/dyn/getValues.json'
@@ -55,17 +69,16 @@ class SMA:
 
     async def _fetch_json(self, url, payload):
         """Fetch json data for requests."""
-        params = {
-            'data': json.dumps(payload),
-            'headers': {'content-type': 'application/json'},
-            'params': {'sid': self.sma_sid} if self.sma_sid else None,
-        }
+        data = _json_dumps(payload)
+        params = {'sid': self.sma_sid} if self.sma_sid else None
         for _ in range(3):
             try:
                 with async_timeout.timeout(3):
-                    res = await self._aio_session.post(self._url + url, **params)
-                    return (await res.json()) or {}
-            except (asyncio.TimeoutError, client_exceptions.ClientError):
+                    res = await self._aio_session.post(self._url + url, data=data, headers=_HEADERS, params=params)
+                    body = await res.read()
+                    return (_json_loads(body) if body.strip() else None) or {}
+            except (asyncio.TimeoutError, client_exceptions.ClientError, ValueError):
+                # Replies that aren't JSON are retried the same as connection errors
                 continue
         return {'err': f"Could not connect to SMA at {self._url} (timeout)"}
 
@@ -105,7 +118,7 @@ class SMA:
     async def new_session(self) -> None:
         """Establish a new session."""
         body = await self._fetch_json(URL_LOGIN, self._new_session_data)
-        self.sma_sid = jmespath.search('result.sid', body)
+        self.sma_sid = _SID_EXPR.search(body)
         if self.sma_sid:
             return
 
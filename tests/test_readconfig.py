@@ -0,0 +1,81 @@
+"""Tests for the YAML configuration checks and cache."""
+
+import copy
+import os
+import sys
+
+import pytest
+import yaml
+
+pytest.importorskip('config')
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'multisma2'))
+
+from config import config_from_dict  # noqa: E402
+
+import readconfig  # noqa: E402
+from exceptions import FailedInitialization  # noqa: E402
+
+
+_INVERTER = {'name': 'sb71', 'url': 'http://sb71', 'username': 'user', 'password': 'secret'}
+_CONFIG = {
+    'multisma2': {
+        'site': {
+            'name': 'Home', 'region': 'US', 'tz': 'America/New_York',
+            'latitude': 42.0, 'longitude': -71.0, 'elevation': 50.0, 'co2_avoided': 0.4,
+        },
+        'solar_properties': {'azimuth': 180.0, 'tilt': 30.0, 'area': 30.0, 'efficiency': 0.2, 'rho': 0.1},
+        'inverters': [{'inverter': _INVERTER}],
+    },
+}
+
+
+def config_with(**sections):
+    """Return a copy of the test configuration with some 'multisma2' sections replaced."""
+    config = copy.deepcopy(_CONFIG)
+    config['multisma2'].update(sections)
+    return config_from_dict(config)
+
+
+@pytest.fixture(autouse=True)
+def clear_cache():
+    yield
+    readconfig.clear_config_cache()
+
+
+def test_valid_config():
+    assert readconfig.check_config(config_with()) is not None
+
+
+@pytest.mark.parametrize('section', ['site', 'solar_properties', 'inverters', 'mqtt', 'settings'])
+def test_empty_section(section):
+    # Required and optional sections with no value are both rejected
+    with pytest.raises(FailedInitialization, match='corrupt or truncated'):
+        readconfig.check_config(config_with(**{section: None}))
+
+
+def test_missing_required_option():
+    # There is no optional 'influxdb2' section, that shouldn't end the checks for the inverters
+    inverter = {key: value for key, value in _INVERTER.items() if key != 'url'}
+    assert readconfig.check_config(config_with(inverters=[{'inverter': inverter}])) is None
+
+
+def test_read_config_cache(tmp_path, monkeypatch):
+    # read_config() looks for the configuration file next to readconfig.py
+    monkeypatch.setattr(readconfig, '__file__', str(tmp_path / 'readconfig.py'))
+    yaml_file = tmp_path / readconfig.CONFIG_YAML
+    yaml_file.write_text(yaml.safe_dump(_CONFIG))
+
+    config = readconfig.read_config()
+    assert config is not None
+    assert readconfig.read_config() is config
+
+    readconfig.clear_config_cache()
+    assert readconfig.read_config() is not config
+    config = readconfig.read_config()
+
+    changed = copy.deepcopy(_CONFIG)
+    changed['multisma2']['site']['name'] = 'Cottage'
+    yaml_file.write_text(yaml.safe_dump(changed))
+    os.utime(yaml_file, ns=(0, 0))
+    assert readconfig.read_config().multisma2.site.name == 'Cottage'